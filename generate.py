@@ -1,30 +1,43 @@
 #!/usr/bin/python3
 
+import errno
 import getopt
 import hashlib
+import mmap
+import os
 import re
 import shutil
+import sqlite3
 import sys
-from io import BufferedIOBase
+from stat import S_ISDIR, S_ISREG
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import lru_cache
+from io import BufferedIOBase, BufferedReader
 from pathlib import Path
+from queue import Queue, Empty
 from threading import current_thread
 from typing import Optional, Match, List, Dict, Pattern, Callable, Union, \
-    TextIO, IO
+    TextIO, IO, Iterator, Set, Tuple
 from zipfile import ZipFile, ZipInfo, is_zipfile
 
 from modules import datafile, header
 from modules.classes import GameEntry, Score, RegionData, \
     GameEntryKeyGenerator, FileData, MultiThreadedProgressBar, IndexedThread, \
-    CustomJsonEncoder
+    CustomJsonEncoder, HashCache
 from modules.header import Rule
-from modules.utils import get_index, check_in_pattern_list, to_int_list, \
-    add_padding, get_or_default, available_columns, trim_to, is_valid
+from modules.utils import check_in_pattern_list, to_int_list, \
+    add_padding, get_or_default, available_columns, trim_to, is_valid, \
+    has_zip_extension, to_index_dict, combine_patterns, relative_path
+
+# A scanned file, its digests and whether it was read without errors
+ProcessedFile = Tuple[FileData, Dict[str, Path], bool]
 
 __version__ = '1.9.10-SNAPSHOT'
 
 PROGRESSBAR: Optional[MultiThreadedProgressBar] = None
 
 FOUND_PREFIX = 'Found: '
+FOUND_PRINT_INTERVAL = 128
 
 THREADS: int = 4
 
@@ -32,6 +45,17 @@ CHUNK_SIZE = 33554432  # 32 MiB
 
 MAX_FILE_SIZE = 268435456  # 256 MiB
 
+PARALLEL_ZIP_SIZE = 536870912  # 512 MiB
+
+COPY_RANGE_SIZE = 1073741824  # 1 GiB
+
+# Errors meaning copy_file_range cannot be used for a given pair of files
+UNSUPPORTED_COPY_ERRNOS = (
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP)
+
 FILE_PREFIX = 'file:'
 
 UNSELECTED = 10000
@@ -39,6 +63,15 @@ NOT_PRERELEASE = "Z"
 
 AVOIDED_ROM_BASE = 1000
 
+PADDED_FIELDS = [
+    (GameEntry.get_version, GameEntry.set_version),
+    (GameEntry.get_revision, GameEntry.set_revision),
+    (GameEntry.get_sample, GameEntry.set_sample),
+    (GameEntry.get_demo, GameEntry.set_demo),
+    (GameEntry.get_beta, GameEntry.set_beta),
+    (GameEntry.get_proto, GameEntry.set_proto)
+]
+
 RULES: List[Rule] = []
 
 LOG_FILE: Optional[TextIO] = None
@@ -46,6 +79,17 @@ LOG_FILE: Optional[TextIO] = None
 JSON_ENCODER = CustomJsonEncoder()
 
 DEBUG = False
+NO_WARNING = False
+
+TRUST_ZIP_CRC = False
+
+HASH_CACHE_FILE: Optional[Path] = None
+
+FILE_KIND = 'file'
+DIR_KIND = 'dir'
+
+# Kinds of the paths that had to be looked up outside of directory listings
+PATH_KINDS: Dict[str, Optional[str]] = {}
 
 COUNTRY_REGION_CORRELATION = [
     # Language needs checking
@@ -79,6 +123,17 @@ COUNTRY_REGION_CORRELATION = [
     RegionData('TAI', re.compile(r'(Taiwan)', re.IGNORECASE), ['zh'])
 ]
 
+REGION_DATA_BY_CODE: Dict[str, RegionData] = {
+    r.code: r for r in COUNTRY_REGION_CORRELATION
+}
+
+# Matches any known region, so most elements are discarded in a single pass
+REGIONS_REGEX = re.compile(
+    '|'.join('(?:%s)' % r.pattern.pattern for r in COUNTRY_REGION_CORRELATION),
+    re.IGNORECASE)
+
+REGION_DATA_BY_ELEMENT: Dict[str, List[RegionData]] = {}
+
 SECTIONS_REGEX = re.compile(r'\(([^()]+)\)')
 BIOS_REGEX = re.compile(re.escape('[BIOS]'), re.IGNORECASE)
 PROGRAM_REGEX = re.compile(r'\((?:Test\s*)?Program\)', re.IGNORECASE)
@@ -94,7 +149,26 @@ REV_REGEX = re.compile(r'\(Rev\s*([a-z0-9.]+)\)', re.IGNORECASE)
 VERSION_REGEX = re.compile(r'\(v\s*([a-z0-9.]+)\)', re.IGNORECASE)
 LANGUAGES_REGEX = re.compile(r'\(([a-z]{2}(?:[,+][a-z]{2})*)\)', re.IGNORECASE)
 BAD_REGEX = re.compile(re.escape('[b]'), re.IGNORECASE)
-ZIP_REGEX = re.compile(r'\.zip$', re.IGNORECASE)
+
+TAG_REGEXES: Dict[str, Pattern] = {
+    'bios': BIOS_REGEX,
+    'program': PROGRAM_REGEX,
+    'enhancement_chip': ENHANCEMENT_CHIP_REGEX,
+    'unl': UNL_REGEX,
+    'pirate': PIRATE_REGEX,
+    'promo': PROMO_REGEX,
+    'beta': BETA_REGEX,
+    'proto': PROTO_REGEX,
+    'sample': SAMPLE_REGEX,
+    'demo': DEMO_REGEX,
+    'bad': BAD_REGEX
+}
+
+# Finds all of the tags above in a single pass over a name
+TAGS_REGEX = re.compile(
+    '|'.join('(?P<%s>%s)' % (tag, regex.pattern)
+             for tag, regex in TAG_REGEXES.items()),
+    re.IGNORECASE)
 ALPHABETICAL_REGEX = re.compile(r'^[a-z]', re.IGNORECASE)
 
 
@@ -110,21 +184,47 @@ def parse_prerelease(match: Optional[Match]) -> str:
     return get_or_default(match, NOT_PRERELEASE)
 
 
+def parse_tags(name: str) -> Dict[str, Match]:
+    tags = {}
+    if '(' not in name and '[' not in name:
+        return tags
+    for tag_match in TAGS_REGEX.finditer(name):
+        tag = tag_match.lastgroup
+        if tag not in tags:
+            # Re-match with the original pattern to get its own groups
+            tags[tag] = TAG_REGEXES[tag].match(tag_match.group())
+    return tags
+
+
 def parse_region_data(name: str) -> List[RegionData]:
     parsed = []
+    if '(' not in name:
+        return parsed
     for section in SECTIONS_REGEX.finditer(name):
         elements = [element.strip() for element in section.group(1).split(',')]
         for element in elements:
+            parsed.extend(match_region_data(element))
+    return parsed
+
+
+def match_region_data(element: str) -> List[RegionData]:
+    matched = REGION_DATA_BY_ELEMENT.get(element)
+    if matched is None:
+        matched = []
+        if REGIONS_REGEX.fullmatch(element):
             for region_data in COUNTRY_REGION_CORRELATION:
                 if region_data.pattern \
                         and region_data.pattern.fullmatch(element):
-                    parsed.append(region_data)
-    return parsed
+                    matched.append(region_data)
+        REGION_DATA_BY_ELEMENT[element] = matched
+    return matched
 
 
 def parse_languages(name: str) -> List[str]:
-    lang_matcher = LANGUAGES_REGEX.search(name)
     languages = []
+    if '(' not in name:
+        return languages
+    lang_matcher = LANGUAGES_REGEX.search(name)
     if lang_matcher:
         for entry in lang_matcher.group(1).split(','):
             for lang in entry.split('+'):
@@ -134,16 +234,13 @@ def parse_languages(name: str) -> List[str]:
 
 def get_region_data(code: str) -> Optional[RegionData]:
     code = code.upper() if code else code
-    region_data = None
-    for r in COUNTRY_REGION_CORRELATION:
-        if r.code == code:
-            region_data = r
-            break
+    region_data = REGION_DATA_BY_CODE.get(code)
     if not region_data:
         # We don't know which region this is, but we should filter/classify it
         log('WARNING: unrecognized region (%s)' % code)
         region_data = RegionData(code, None, [])
         COUNTRY_REGION_CORRELATION.append(region_data)
+        REGION_DATA_BY_CODE[code] = region_data
     return region_data
 
 
@@ -156,28 +253,21 @@ def get_languages(region_data_list: List[RegionData]) -> List[str]:
     return languages
 
 
-def is_present(code: str, region_data: List[RegionData]) -> bool:
-    for r in region_data:
-        if r.code == code:
-            return True
-    return False
-
-
-def validate_dat(file: Path, use_hashes: bool) -> None:
-    root = datafile.parse(file, silence=True)
+def validate_dat(root: datafile.datafile, use_hashes: bool) -> None:
     has_cloneof = False
     lacks_sha1 = False
     offending_entry = ''
     for game in root.game:
-        if game.cloneof:
+        if not has_cloneof and game.cloneof:
             has_cloneof = True
+        if use_hashes and not lacks_sha1:
+            for game_rom in game.rom:
+                if not game_rom.sha1:
+                    lacks_sha1 = True
+                    offending_entry = game.name
+                    break
+        if has_cloneof and (lacks_sha1 or not use_hashes):
             break
-    for game in root.game:
-        for game_rom in game.rom:
-            if not game_rom.sha1:
-                lacks_sha1 = True
-                offending_entry = game.name
-                break
     if use_hashes and lacks_sha1:
         sys.exit(
             'ERROR: Cannot use hash information because DAT lacks SHA1 digests '
@@ -199,7 +289,7 @@ def validate_dat(file: Path, use_hashes: bool) -> None:
 
 
 def parse_games(
-        file: Path,
+        root: datafile.datafile,
         filter_bios: bool,
         filter_program: bool,
         filter_enhancement_chip: bool,
@@ -212,24 +302,25 @@ def parse_games(
         filter_sample: bool,
         exclude: List[Pattern]) -> Dict[str, List[GameEntry]]:
     games = {}
-    root = datafile.parse(file, silence=True)
-    for input_index in range(0, len(root.game)):
-        game = root.game[input_index]
-        beta_match = BETA_REGEX.search(game.name)
-        demo_match = DEMO_REGEX.search(game.name)
-        sample_match = SAMPLE_REGEX.search(game.name)
-        proto_match = PROTO_REGEX.search(game.name)
-        if filter_bios and BIOS_REGEX.search(game.name):
+    for input_index, game in enumerate(root.game):
+        # Avoids looking up the attribute again for every check below
+        name = game.name
+        tags = parse_tags(name)
+        beta_match = tags.get('beta')
+        demo_match = tags.get('demo')
+        sample_match = tags.get('sample')
+        proto_match = tags.get('proto')
+        if filter_bios and 'bios' in tags:
             continue
-        if filter_unlicensed and UNL_REGEX.search(game.name):
+        if filter_unlicensed and 'unl' in tags:
             continue
-        if filter_pirate and PIRATE_REGEX.search(game.name):
+        if filter_pirate and 'pirate' in tags:
             continue
-        if filter_promo and PROMO_REGEX.search(game.name):
+        if filter_promo and 'promo' in tags:
             continue
-        if filter_program and PROGRAM_REGEX.search(game.name):
+        if filter_program and 'program' in tags:
             continue
-        if filter_enhancement_chip and ENHANCEMENT_CHIP_REGEX.search(game.name):
+        if filter_enhancement_chip and 'enhancement_chip' in tags:
             continue
         if filter_beta and beta_match:
             continue
@@ -239,10 +330,10 @@ def parse_games(
             continue
         if filter_proto and proto_match:
             continue
-        if check_in_pattern_list(game.name, exclude):
+        if check_in_pattern_list(name, exclude):
             continue
         is_parent = not game.cloneof
-        is_bad = bool(BAD_REGEX.search(game.name))
+        is_bad = 'bad' in tags
         beta = parse_prerelease(beta_match)
         demo = parse_prerelease(demo_match)
         sample = parse_prerelease(sample_match)
@@ -252,16 +343,19 @@ def parse_games(
             or demo_match
             or sample_match
             or proto_match)
-        revision = parse_revision(game.name)
-        version = parse_version(game.name)
-        region_data = parse_region_data(game.name)
+        revision = parse_revision(name)
+        version = parse_version(name)
+        region_data = parse_region_data(name)
+        present_codes = {rd.code for rd in region_data}
         for release in game.release:
-            if release.region and not is_present(release.region, region_data):
-                region_data.append(get_region_data(release.region))
-        languages = parse_languages(game.name)
+            if release.region and release.region not in present_codes:
+                release_region_data = get_region_data(release.region)
+                region_data.append(release_region_data)
+                present_codes.add(release_region_data.code)
+        languages = parse_languages(name)
         if not languages:
             languages = get_languages(region_data)
-        parent_name = game.cloneof if game.cloneof else game.name
+        parent_name = game.cloneof if game.cloneof else name
         region_codes = [rd.code for rd in region_data]
         game_entries: List[GameEntry] = []
         for region in region_codes:
@@ -279,7 +373,7 @@ def parse_games(
                     beta,
                     proto,
                     is_parent,
-                    game.name,
+                    name,
                     game.rom if game.rom else []))
         if game_entries:
             if parent_name not in games:
@@ -287,118 +381,282 @@ def parse_games(
             else:
                 games[parent_name].extend(game_entries)
         else:
-            log('WARNING [%s]: no recognizable regions found' % game.name)
+            log('WARNING [%s]: no recognizable regions found' % name)
         if not game.rom:
-            log('WARNING [%s]: no ROMs found in the DAT file' % game.name)
+            log('WARNING [%s]: no ROMs found in the DAT file' % name)
     return games
 
 
 def pad_values(
         games: List[GameEntry],
-        get_function: Callable[[GameEntry], str],
-        set_function: Callable[[GameEntry, str], None]) -> None:
-    padded = add_padding([get_function(g) for g in games])
-    for i in range(0, len(padded)):
-        set_function(games[i], padded[i])
+        fields: List[Tuple[
+            Callable[[GameEntry], str],
+            Callable[[GameEntry, str], None]]]) -> None:
+    for get_function, set_function in fields:
+        values = [get_function(g) for g in games]
+        # Padding is a no-op when all values are the same (e.g. no revision)
+        if values.count(values[0]) == len(values):
+            continue
+        padded = add_padding(values)
+        for i in range(0, len(padded)):
+            set_function(games[i], padded[i])
 
 
 def language_value(
         languages: List[str],
         weight: int,
-        selected_languages: List[str]) -> int:
-    return sum([
-        (get_index(selected_languages, lang, -1) + 1) * weight * -1
-        for lang in languages])
+        language_ranks: Dict[str, int]) -> int:
+    return -weight * sum(language_ranks.get(lang, 0) for lang in languages)
 
 
 def index_files(
         input_dir: Path,
-        dat_file: Path) -> Dict[str, Optional[Path]]:
+        root: datafile.datafile) -> Dict[str, Optional[Path]]:
     result: Dict[str, Optional[Path]] = {}
     also_check_archive: bool = False
-    root = datafile.parse(dat_file, silence=True)
     global RULES
     if not RULES:
         RULES = get_header_rules(root)
+    # Files of any other size cannot match a ROM, unless they are archives
+    # (detected by content, as in process_file) or have headers which must be
+    # skipped before hashing
+    wanted_sizes: Optional[Set[int]] = None if RULES else set()
+    # Maps CRC32 and size to a SHA1 digest, or to None if that is ambiguous
+    crc_index: Dict[Tuple[int, int], Optional[str]] = {}
     for game in root.game:
         for rom_entry in game.rom:
-            result[rom_entry.sha1.lower()] = None
-            also_check_archive |= bool(ZIP_REGEX.search(rom_entry.name))
-    print('Scanning directory: %s\033[K' % input_dir, file=sys.stderr)
-    files_data = []
-    for full_path in input_dir.rglob('*'):
-        if not full_path.is_file():
-            continue
-        try:
-            print(
-                '%s%s\033[K' % (
-                    FOUND_PREFIX,
-                    trim_to(
-                        full_path.relative_to(input_dir),
-                        available_columns(FOUND_PREFIX) - 2)),
-                end='\r',
-                file=sys.stderr)
-            file_size = full_path.stat().st_size
-            files_data.append(FileData(file_size, full_path))
-        except OSError as e:
-            print(
-                'Error while reading file: %s\033[K' % e,
-                file=sys.stderr)
-    files_data.sort(key=FileData.get_size, reverse=True)
-    print('%s%i files\033[K' % (FOUND_PREFIX, len(files_data)), file=sys.stderr)
-
-    if files_data:
-        global PROGRESSBAR
-        PROGRESSBAR = MultiThreadedProgressBar(
-            len(files_data),
-            THREADS,
-            prefix='Calculating hashes')
-        PROGRESSBAR.init()
-
-        def process_thread_with_progress(
-                shared_files_data: List[FileData],
-                shared_result_data: List[Dict[str, Path]]) -> None:
-            curr_thread = current_thread()
-            if not isinstance(curr_thread, IndexedThread):
-                sys.exit('Bad thread type. Expected %s' % IndexedThread)
-            while True:
+            # Digests are normalized once here, as hexdigest() is lowercase
+            rom_entry.sha1 = rom_entry.sha1.lower()
+            result[rom_entry.sha1] = None
+            also_check_archive |= has_zip_extension(rom_entry.name)
+            if TRUST_ZIP_CRC and rom_entry.crc and rom_entry.size:
                 try:
-                    next_file = shared_files_data.pop(0)
-                    PROGRESSBAR.print_thread(
-                        curr_thread.index,
-                        next_file.path.relative_to(input_dir))
-                    shared_result_data.append(process_file(
-                        next_file,
-                        also_check_archive))
-                    PROGRESSBAR.print_bar()
-                except IndexError:
-                    PROGRESSBAR.print_thread(curr_thread.index, "DONE")
-                    break
+                    crc_key = (int(rom_entry.crc, 16), int(rom_entry.size))
+                    sha1 = rom_entry.sha1
+                    if crc_index.setdefault(crc_key, sha1) != sha1:
+                        crc_index[crc_key] = None
+                except ValueError:
+                    pass
+            if wanted_sizes is not None:
+                if rom_entry.size and rom_entry.size.isdigit():
+                    wanted_sizes.add(int(rom_entry.size))
+                else:
+                    wanted_sizes = None
 
-        threads = []
-        intermediate_results = []
-        for i in range(0, THREADS):
-            t = IndexedThread(
-                index=i,
-                target=process_thread_with_progress,
-                args=[files_data, intermediate_results],
-                daemon=True)
-            t.start()
-            threads.append(t)
-
-        for t in threads:
-            t.join()
-
-        print('\n', file=sys.stderr)
-
-        for intermediate_result in intermediate_results:
-            for key, value in intermediate_result.items():
-                if key in result and not \
-                        (result[key] and is_zipfile(result[key])):
-                    result[key] = value
+    def merge_result(file_result: Dict[str, Path]) -> None:
+        for key, value in file_result.items():
+            if key in result and not \
+                    (result[key] and is_zipfile(result[key])):
+                result[key] = value
+
+    hash_cache: Optional[HashCache] = None
+    # Digests of headered files depend on the rules, so they are not cached
+    if HASH_CACHE_FILE and not RULES:
+        try:
+            hash_cache = HashCache(HASH_CACHE_FILE)
+        except sqlite3.Error as e:
+            sys.exit(help_msg('invalid hash cache file: %s (%s)'
+                              % (HASH_CACHE_FILE, e)))
+    cache_options = 'archives=%i,trust-zip-crc=%i' \
+                    % (also_check_archive, TRUST_ZIP_CRC)
+    # Absolute paths and modification times under which hashes are cached
+    cache_keys: Dict[Path, Tuple[str, int]] = {}
+    cached_files = 0
+    try:
+        print('Scanning directory: %s\033[K' % input_dir, file=sys.stderr)
+        files_data = []
+        for entry in scan_files(str(input_dir)):
+            try:
+                file_stat = entry.stat()
+                file_size = file_stat.st_size
+                if wanted_sizes is not None \
+                        and file_size not in wanted_sizes \
+                        and not has_zip_extension(entry.name) \
+                        and not is_zipfile(entry.path):
+                    continue
+                full_path = Path(entry.path)
+                if hash_cache:
+                    cache_path = os.path.abspath(entry.path)
+                    cached_digests = hash_cache.get(
+                        cache_path,
+                        cache_options,
+                        file_size,
+                        file_stat.st_mtime_ns)
+                    if cached_digests is not None:
+                        merge_result({d: full_path for d in cached_digests})
+                        cached_files += 1
+                        continue
+                    cache_keys[full_path] = \
+                        (cache_path, file_stat.st_mtime_ns)
+                files_data.append(FileData(file_size, full_path))
+                if len(files_data) % FOUND_PRINT_INTERVAL == 0:
+                    print(
+                        '%s%s\033[K' % (
+                            FOUND_PREFIX,
+                            trim_to(
+                                relative_path(entry.path, str(input_dir)),
+                                available_columns(FOUND_PREFIX) - 2)),
+                        end='\r',
+                        file=sys.stderr)
+            except OSError as e:
+                print(
+                    'Error while reading file: %s\033[K' % e,
+                    file=sys.stderr)
+        files_data.sort(key=FileData.get_size, reverse=True)
+        print(
+            '%s%i files\033[K'
+            % (FOUND_PREFIX, len(files_data) + cached_files),
+            file=sys.stderr)
+        if hash_cache:
+            print('Cached: %i files\033[K' % cached_files, file=sys.stderr)
+
+        if files_data:
+            num_threads = min(THREADS, len(files_data))
+            global PROGRESSBAR
+            PROGRESSBAR = MultiThreadedProgressBar(
+                len(files_data),
+                num_threads,
+                prefix='Calculating hashes')
+            PROGRESSBAR.init()
+
+            def process_thread_with_progress(
+                    shared_files_data: 'Queue[FileData]',
+                    shared_result_data: 'Queue[Optional[ProcessedFile]]') \
+                    -> None:
+                try:
+                    curr_thread = current_thread()
+                    if not isinstance(curr_thread, IndexedThread):
+                        sys.exit(
+                            'Bad thread type. Expected %s' % IndexedThread)
+                    while True:
+                        try:
+                            next_file = shared_files_data.get_nowait()
+                        except Empty:
+                            PROGRESSBAR.print_thread(curr_thread.index, "DONE")
+                            break
+                        PROGRESSBAR.print_thread(
+                            curr_thread.index,
+                            relative_path(str(next_file.path), str(input_dir)))
+                        file_result, complete = process_file(
+                            next_file,
+                            also_check_archive,
+                            crc_index,
+                            entry_pool)
+                        shared_result_data.put(
+                            (next_file, file_result, complete))
+                        PROGRESSBAR.print_bar()
+                finally:
+                    # Signals this thread is done
+                    shared_result_data.put(None)
+
+            files_queue: 'Queue[FileData]' = Queue()
+            for file_data in files_data:
+                files_queue.put_nowait(file_data)
+
+            # Hashes the entries of big archives, so their files are not all
+            # processed by a single thread
+            entry_pool = ThreadPoolExecutor(num_threads) if num_threads > 1 \
+                else None
+
+            threads = []
+            results_queue: 'Queue[Optional[ProcessedFile]]' = Queue()
+            for i in range(0, num_threads):
+                t = IndexedThread(
+                    index=i,
+                    target=process_thread_with_progress,
+                    args=[files_queue, results_queue],
+                    daemon=True)
+                t.start()
+                threads.append(t)
+
+            # Results are merged as they arrive, so they are not kept around
+            running_threads = len(threads)
+            while running_threads:
+                queued_result = results_queue.get()
+                if queued_result is None:
+                    running_threads -= 1
+                    continue
+                file_data, file_result, complete = queued_result
+                merge_result(file_result)
+                # Files which could not be fully read are tried again next time
+                if hash_cache and complete and file_result:
+                    cache_path, mtime = cache_keys[file_data.path]
+                    hash_cache.put(
+                        cache_path,
+                        cache_options,
+                        file_data.size,
+                        mtime,
+                        list(file_result))
+
+            for t in threads:
+                t.join()
+            if entry_pool:
+                entry_pool.shutdown()
+
+            print('\n', file=sys.stderr)
+    finally:
+        # Hashes computed so far are kept, even if the scan is interrupted
+        if hash_cache:
+            hash_cache.close()
     return result
 
 
+def scan_files(directory: str) -> Iterator[os.DirEntry]:
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from scan_files(entry.path)
+                    elif entry.is_file():
+                        yield entry
+                except OSError as e:
+                    print(
+                        'Error while reading file: %s\033[K' % e,
+                        file=sys.stderr)
+    except PermissionError as e:
+        print(
+            'Error while reading directory: %s\033[K' % e,
+            file=sys.stderr)
+
+
+@lru_cache(maxsize=64)
+def list_dir(directory: str) -> Dict[str, os.DirEntry]:
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name: entry for entry in entries}
+    except OSError:
+        return {}
+
+
+def path_kind(directory: Path, name: str) -> Optional[str]:
+    entry = list_dir(str(directory)).get(name)
+    if entry:
+        try:
+            if entry.is_file():
+                return FILE_KIND
+            if entry.is_dir():
+                return DIR_KIND
+        except OSError:
+            pass
+        return None
+    # Names may still match on case-insensitive file systems
+    path = os.path.join(str(directory), name)
+    if path not in PATH_KINDS:
+        try:
+            mode = os.stat(path).st_mode
+            PATH_KINDS[path] = FILE_KIND if S_ISREG(mode) \
+                else DIR_KIND if S_ISDIR(mode) else None
+        except OSError:
+            PATH_KINDS[path] = None
+    return PATH_KINDS[path]
+
+
+def forget_path(directory: Path, name: str) -> None:
+    list_dir(str(directory)).pop(name, None)
+    PATH_KINDS[os.path.join(str(directory), name)] = None
+
+
 def get_header_rules(root: datafile) -> List[Rule]:
     if root.header.clrmamepro:
         if root.header.clrmamepro.header:
@@ -416,27 +674,54 @@ def get_header_rules(root: datafile) -> List[Rule]:
 # noinspection PyBroadException
 def process_file(
         file_data: FileData,
-        also_check_archive: bool) -> Dict[str, Path]:
+        also_check_archive: bool,
+        crc_index: Dict[Tuple[int, int], Optional[str]],
+        entry_pool: Optional[Executor] = None) \
+        -> Tuple[Dict[str, Path], bool]:
     full_path = file_data.path
     result: Dict[str, Path] = {}
+    complete = True
     is_zip = is_zipfile(full_path)
     if is_zip:
         try:
             with ZipFile(full_path) as compressed_file:
-                infos: List[ZipInfo] = compressed_file.infolist()
-                for file_info in infos:
-                    if file_info.is_dir():
-                        continue
-                    file_size = file_info.file_size
-                    with compressed_file.open(file_info) as internal_file:
-                        digest = compute_hash(file_size, internal_file)
-                        result[digest] = full_path
-                        if DEBUG:
-                            log("DEBUG: Scan result for file [%s]: %s"
-                                % (
-                                    "%s:%s" % (full_path, file_info.filename),
-                                    digest))
+                infos: List[ZipInfo] = [
+                    file_info for file_info in compressed_file.infolist()
+                    if not file_info.is_dir()]
+                digests = [
+                    crc_index.get((file_info.CRC, file_info.file_size))
+                    for file_info in infos]
+                unknown_infos = [
+                    file_info for file_info, digest in zip(infos, digests)
+                    if not digest]
+                if entry_pool \
+                        and len(unknown_infos) > 1 \
+                        and file_data.size >= PARALLEL_ZIP_SIZE:
+                    def compute_in_pool(pool_file_info: ZipInfo) -> str:
+                        # Each thread reads from its own handle
+                        with ZipFile(full_path) as pool_compressed_file:
+                            return compute_zip_entry_hash(
+                                pool_compressed_file,
+                                pool_file_info)
+
+                    computed_digests = entry_pool.map(
+                        compute_in_pool,
+                        unknown_infos)
+                else:
+                    computed_digests = (
+                        compute_zip_entry_hash(compressed_file, file_info)
+                        for file_info in unknown_infos)
+                for file_info, digest in zip(infos, digests):
+                    if not digest:
+                        digest = next(computed_digests)
+                    result[digest] = full_path
+                    if DEBUG:
+                        log("DEBUG: Scan result for file [%s]: %s"
+                            % (
+                                "%s:%s" % (full_path, file_info.filename),
+                                digest))
         except Exception as e:
+            complete = False
             print(
                 'Error while reading file [%s]: %s\033[K' % (full_path, e),
                 file=sys.stderr)
@@ -452,10 +737,18 @@ def process_file(
                         (result[digest] and is_zipfile(result[digest])):
                     result[digest] = full_path
         except Exception as e:
+            complete = False
             print(
                 'Error while reading file: %s\033[K' % e,
                 file=sys.stderr)
-    return result
+    return result, complete
+
+
+def compute_zip_entry_hash(
+        compressed_file: ZipFile,
+        file_info: ZipInfo) -> str:
+    with compressed_file.open(file_info) as internal_file:
+        return compute_hash(file_info.file_size, internal_file)
 
 
 def compute_hash(
@@ -468,13 +761,29 @@ def compute_hash(
             if rule.test(file_bytes):
                 file_bytes = rule.apply(file_bytes)
         hasher.update(file_bytes)
-    else:
-        while True:
-            chunk = internal_file.read(CHUNK_SIZE)
-            if not chunk:
-                break
-            hasher.update(chunk)
-    return hasher.hexdigest().lower()
+        return hasher.hexdigest()
+    if file_size and isinstance(internal_file, BufferedReader):
+        # Regular files are mapped into memory and hashed without copies,
+        # in a single call which does not hold the GIL
+        try:
+            with mmap.mmap(
+                    internal_file.fileno(),
+                    0,
+                    access=mmap.ACCESS_READ) as mapped_file:
+                hasher.update(mapped_file)
+            return hasher.hexdigest()
+        except (OSError, ValueError, OverflowError):
+            # Too big for the address space, or mapping is not supported by
+            # the file system, so the file is read in chunks instead
+            hasher = hashlib.sha1()
+    read = internal_file.read
+    update = hasher.update
+    while True:
+        chunk = read(CHUNK_SIZE)
+        if not chunk:
+            break
+        update(chunk)
+    return hasher.hexdigest()
 
 
 def main(argv: List[str]):
@@ -517,11 +826,14 @@ def main(argv: List[str]):
             'prefer-prereleases',
             'all-regions-with-lang',
             'debug',
+            'no-warning',
             'move',
             'chunk-size=',
             'threads=',
             'header-file=',
             'max-file-size=',
+            'trust-zip-crc',
+            'hash-cache=',
             'version',
             'only-selected-lang',
             'group-by-first-letter'
@@ -571,6 +883,9 @@ def main(argv: List[str]):
     global MAX_FILE_SIZE
     global CHUNK_SIZE
     global DEBUG
+    global NO_WARNING
+    global TRUST_ZIP_CRC
+    global HASH_CACHE_FILE
     for opt, arg in opts:
         if opt in ('-h', '--help'):
             print(help_msg())
@@ -611,6 +926,7 @@ def main(argv: List[str]):
         version_asc |= opt == '--early-versions'
         DEBUG |= opt == '--debug'
         verbose |= DEBUG or opt in ('-V', '--verbose')
+        NO_WARNING |= opt == '--no-warning'
         ignore_case |= opt == '--ignore-case'
         regex |= opt == '--regex'
         if opt == '--separator':
@@ -656,6 +972,12 @@ def main(argv: List[str]):
             RULES = header.parse_rules(header_file)
         if opt == '--max-file-size':
             MAX_FILE_SIZE = int(arg)
+        TRUST_ZIP_CRC |= opt == '--trust-zip-crc'
+        if opt == '--hash-cache':
+            HASH_CACHE_FILE = Path(arg.strip()).expanduser()
+            if HASH_CACHE_FILE.is_dir():
+                sys.exit(help_msg('invalid hash cache file: %s'
+                                  % HASH_CACHE_FILE))
         group_by_first_letter |= opt == '--group-by-first-letter'
 
     if not no_scan and not input_dir:
@@ -719,16 +1041,17 @@ def main(argv: List[str]):
     except (re.error, OSError) as e:
         sys.exit(help_msg('invalid exclude-after list: %s' % e))
 
-    validate_dat(dat_file, use_hashes)
+    root = datafile.parse(dat_file, silence=True)
+    validate_dat(root, use_hashes)
 
     hash_index: Dict[str, Optional[Path]] = {}
     if use_hashes and input_dir:
-        hash_index = index_files(input_dir, dat_file)
+        hash_index = index_files(input_dir, root)
         if DEBUG:
             log('DEBUG: Scanned files: %s' % JSON_ENCODER.encode(hash_index))
 
     parsed_games = parse_games(
-        dat_file,
+        root,
         filter_bios,
         filter_program,
         filter_enhancement_chip,
@@ -798,6 +1121,9 @@ def main(argv: List[str]):
              'Earliest' if version_asc else 'Latest'),
             file=sys.stderr)
 
+    # Ranks start at 1, as unselected languages must not add to the score
+    language_ranks = to_index_dict(selected_languages, 1)
+    region_ranks = to_index_dict(selected_regions)
     key_generator = GameEntryKeyGenerator(
         prioritize_languages,
         prefer_prereleases,
@@ -807,34 +1133,11 @@ def main(argv: List[str]):
         avoid)
     for key in parsed_games:
         games = parsed_games[key]
-        pad_values(
-            games,
-            GameEntry.get_version,
-            GameEntry.set_version)
-        pad_values(
-            games,
-            GameEntry.get_revision,
-            GameEntry.set_revision)
-        pad_values(
-            games,
-            GameEntry.get_sample,
-            GameEntry.set_sample)
-        pad_values(
-            games,
-            GameEntry.get_demo,
-            GameEntry.set_demo)
-        pad_values(
-            games,
-            GameEntry.get_beta,
-            GameEntry.set_beta)
-        pad_values(
-            games,
-            GameEntry.get_proto,
-            GameEntry.set_proto)
+        pad_values(games, PADDED_FIELDS)
         set_scores(
             games,
-            selected_regions,
-            selected_languages,
+            region_ranks,
+            language_ranks,
             language_weight,
             revision_asc,
             version_asc)
@@ -845,6 +1148,9 @@ def main(argv: List[str]):
                 % (key, [g.name for g in games]))
 
     printed_items: List[str] = []
+    extension_suffix = add_extension('', file_extension)
+    copy_pool = ThreadPoolExecutor(THREADS) \
+        if output_dir and not move and THREADS > 1 else None
 
     def include_candidate(x: GameEntry) -> bool:
         if only_selected_lang and x.score.languages >= 0:
@@ -855,16 +1161,126 @@ def main(argv: List[str]):
             return True
         return x.score.region != UNSELECTED
 
-    for game in sorted(parsed_games.keys()):
+    def find_by_hash(
+            entry: GameEntry,
+            curr_out_dir: Optional[Path],
+            game_items: List[str],
+            messages: List[str]) -> bool:
+        copied_files = set()
+        transfers: List[Tuple[Path, Path]] = []
+        num_roms = len(entry.roms)
+        for entry_rom in entry.roms:
+            rom_input_path = hash_index[entry_rom.sha1]
+            if rom_input_path:
+                is_zip = is_zipfile(rom_input_path)
+                if not curr_out_dir:
+                    if rom_input_path not in copied_files:
+                        game_items.append(relative_path(
+                            str(rom_input_path),
+                            str(input_dir)))
+                        copied_files.add(rom_input_path)
+                elif rom_input_path not in copied_files:
+                    if not is_zip and num_roms > 1:
+                        rom_output_dir = curr_out_dir / entry.name
+                    else:
+                        rom_output_dir = curr_out_dir
+                    rom_output_dir.mkdir(
+                        parents=True,
+                        exist_ok=True)
+                    if is_zip:
+                        zip_name = entry.name + '.zip'
+                        rom_output_path = rom_output_dir / zip_name
+                    else:
+                        rom_output_path = rom_output_dir / entry_rom.name
+                    transfers.append((rom_input_path, rom_output_path))
+                    copied_files.add(rom_input_path)
+            elif not NO_WARNING:
+                messages.append(
+                    'WARNING: ROM file [%s] for candidate [%s] '
+                    'not found' % (entry_rom.name, entry.name))
+        if transfers:
+            transfer_files(transfers, move, copy_pool)
+        if copied_files:
+            return True
+        if not NO_WARNING:
+            messages.append(
+                'WARNING: candidate [%s] not found, trying next one'
+                % entry.name)
+        return False
+
+    def find_by_name(
+            entry: GameEntry,
+            curr_out_dir: Optional[Path],
+            game_items: List[str],
+            messages: List[str]) -> bool:
+        file_name = entry.name + extension_suffix
+        kind = path_kind(input_dir, file_name)
+        if kind == FILE_KIND:
+            if curr_out_dir:
+                curr_out_dir.mkdir(parents=True, exist_ok=True)
+                transfer_file(input_dir / file_name, curr_out_dir, move)
+                if move:
+                    forget_path(input_dir, file_name)
+            else:
+                game_items.append(file_name)
+            return True
+        if kind == DIR_KIND:
+            full_path = input_dir / file_name
+            if curr_out_dir:
+                rom_output_dir = curr_out_dir / file_name
+            transfers = []
+            for entry_rom in entry.roms:
+                if path_kind(full_path, entry_rom.name) == FILE_KIND:
+                    if curr_out_dir:
+                        transfers.append(
+                            (full_path / entry_rom.name, rom_output_dir))
+                        if move:
+                            forget_path(full_path, entry_rom.name)
+                    else:
+                        game_items.append(file_name + '/' + entry_rom.name)
+                elif not NO_WARNING:
+                    messages.append(
+                        'WARNING: ROM file [%s] for candidate [%s] '
+                        'not found' % (entry_rom.name, file_name))
+            if transfers:
+                rom_output_dir.mkdir(parents=True, exist_ok=True)
+                transfer_files(transfers, move, copy_pool)
+                shutil.copystat(str(full_path), str(rom_output_dir))
+            return True
+        if not NO_WARNING:
+            messages.append(
+                'WARNING: candidate [%s] not found, trying next one'
+                % file_name)
+        return False
+
+    def list_name(
+            entry: GameEntry,
+            curr_out_dir: Optional[Path],
+            game_items: List[str],
+            messages: List[str]) -> bool:
+        game_items.append(entry.name + extension_suffix)
+        return True
+
+    # The way candidates are looked up is fixed for the whole run
+    if use_hashes:
+        find_candidate = find_by_hash
+    elif input_dir:
+        find_candidate = find_by_name
+    else:
+        find_candidate = list_name
+
+    def process_game(game: str) -> Tuple[List[str], List[str]]:
         entries = parsed_games[game]
+        game_items: List[str] = []
+        messages: List[str] = []
         if DEBUG:
-            log(
+            messages.append(
                 'DEBUG: Candidates for game [%s] before filtering: %s'
                 % (game, JSON_ENCODER.encode(entries)))
         if not all_regions:
             entries = [x for x in entries if include_candidate(x)]
         if DEBUG:
-            log(
+            messages.append(
                 'DEBUG: Candidates for game [%s] after filtering: %s'
                 % (game, JSON_ENCODER.encode(entries)))
         size = len(entries)
@@ -878,97 +1294,28 @@ def main(argv: List[str]):
                                (entry.name[0].lower()
                                 if ALPHABETICAL_REGEX.search(entry.name)
                                 else '#')
-            if use_hashes:
-                copied_files = set()
-                num_roms = len(entry.roms)
-                for entry_rom in entry.roms:
-                    digest = entry_rom.sha1.lower()
-                    rom_input_path = hash_index[digest]
-                    if rom_input_path:
-                        is_zip = is_zipfile(rom_input_path)
-                        file = rom_input_path.relative_to(input_dir)
-                        if not curr_out_dir:
-                            if rom_input_path not in copied_files:
-                                printed_items.append(str(file))
-                                copied_files.add(rom_input_path)
-                        elif rom_input_path not in copied_files:
-                            if not is_zip and num_roms > 1:
-                                rom_output_dir = curr_out_dir / entry.name
-                            else:
-                                rom_output_dir = curr_out_dir
-                            rom_output_dir.mkdir(
-                                parents=True,
-                                exist_ok=True)
-                            if is_zip:
-                                zip_name = add_extension(entry.name, 'zip')
-                                rom_output_path = rom_output_dir / zip_name
-                            else:
-                                rom_output_path = \
-                                    rom_output_dir / entry_rom.name
-                            transfer_file(
-                                rom_input_path,
-                                rom_output_path,
-                                move)
-                            copied_files.add(rom_input_path)
-                    else:
-                        log(
-                            'WARNING: ROM file [%s] for candidate [%s] '
-                            'not found' % (entry_rom.name, entry.name))
-                if copied_files:
-                    break
-                else:
-                    log(
-                        'WARNING: candidate [%s] not found, trying next one'
-                        % entry.name)
-                    if i == size - 1:
-                        log(
-                            'WARNING: no eligible candidates for [%s] '
-                            'have been found!' % game)
-            elif input_dir:
-                file_name = add_extension(entry.name, file_extension)
-                full_path = input_dir / file_name
-                if full_path.is_file():
-                    if curr_out_dir:
-                        curr_out_dir.mkdir(parents=True, exist_ok=True)
-                        transfer_file(full_path, curr_out_dir, move)
-                    else:
-                        printed_items.append(file_name)
-                    break
-                elif full_path.is_dir():
-                    for entry_rom in entry.roms:
-                        rom_input_path = full_path / entry_rom.name
-                        if rom_input_path.is_file():
-                            if curr_out_dir:
-                                rom_output_dir = curr_out_dir / file_name
-                                rom_output_dir.mkdir(
-                                    parents=True,
-                                    exist_ok=True)
-                                transfer_file(
-                                    rom_input_path,
-                                    rom_output_dir,
-                                    move)
-                                shutil.copystat(
-                                    str(full_path),
-                                    str(rom_output_dir))
-                            else:
-                                printed_items.append(
-                                    file_name + '/' + entry_rom.name)
-                        else:
-                            log(
-                                'WARNING: ROM file [%s] for candidate [%s] '
-                                'not found' % (entry_rom.name, file_name))
-                    break
-                else:
-                    log(
-                        'WARNING: candidate [%s] not found, trying next one'
-                        % file_name)
-                    if i == size - 1:
-                        log(
-                            'WARNING: no eligible candidates for [%s] '
-                            'have been found!' % game)
-            else:
-                printed_items.append(add_extension(entry.name, file_extension))
+            if find_candidate(entry, curr_out_dir, game_items, messages):
                 break
+            if i == size - 1 and not NO_WARNING:
+                messages.append(
+                    'WARNING: no eligible candidates for [%s] '
+                    'have been found!' % game)
+        return game_items, messages
+
+    # Moves stay serial, as candidates of different games may share files
+    game_pool = ThreadPoolExecutor(THREADS) \
+        if output_dir and not move and THREADS > 1 else None
+    results = (game_pool.map if game_pool else map)(
+        process_game,
+        sorted(parsed_games.keys()))
+    for game_items, messages in results:
+        printed_items.extend(game_items)
+        if messages:
+            log_lines(messages)
+    if game_pool:
+        game_pool.shutdown()
+    if copy_pool:
+        copy_pool.shutdown()
     printed_items.sort()
     for item in printed_items:
         print(item)
@@ -984,41 +1331,55 @@ def parse_list(
         arg_str: str,
         ignore_case: bool,
         regex: bool,
-        separator: str) -> List[Pattern]:
+        separator: str) -> Tuple[Pattern, ...]:
     if arg_str:
         if arg_str.startswith(FILE_PREFIX):
             file = Path((arg_str[len(FILE_PREFIX):]).strip()).expanduser()
             if not file.is_file():
                 raise OSError('invalid file: %s' % file)
-            arg_list = [x.strip() for x in open(file) if is_valid(x)]
-        else:
-            arg_list = [x.strip() for x in arg_str.split(separator)
-                        if is_valid(x)]
-        if ignore_case:
-            return [re.compile(x if regex else re.escape(x), re.IGNORECASE)
-                    for x in arg_list if is_valid(x)]
+            arg_list = read_list_file(file, file.stat().st_mtime_ns)
         else:
-            return [re.compile(x if regex else re.escape(x))
-                    for x in arg_list if is_valid(x)]
-    return []
+            arg_list = tuple(x.strip() for x in arg_str.split(separator)
+                             if is_valid(x))
+        return compile_patterns(arg_list, ignore_case, regex)
+    return ()
+
+
+@lru_cache(maxsize=None)
+def read_list_file(file: Path, mtime: int) -> Tuple[str, ...]:
+    # The modification time is only part of the key, so edits are picked up
+    with open(file) as list_file:
+        return tuple(x.strip() for x in list_file if is_valid(x))
+
+
+@lru_cache(maxsize=None)
+def compile_patterns(
+        arg_list: Tuple[str, ...],
+        ignore_case: bool,
+        regex: bool) -> Tuple[Pattern, ...]:
+    flags = re.IGNORECASE if ignore_case else 0
+    sources = arg_list if regex else map(re.escape, arg_list)
+    # Matched as a single pattern whenever possible, scanning names only once
+    return combine_patterns(tuple(re.compile(x, flags) for x in sources))
 
 
 def set_scores(
         games: List[GameEntry],
-        selected_regions: List[str],
-        selected_languages: List[str],
+        region_ranks: Dict[str, int],
+        language_ranks: Dict[str, int],
         language_weight: int,
         revision_asc: bool,
         version_asc: bool) -> None:
+    revision_multiplier = 1 if revision_asc else -1
+    version_multiplier = 1 if version_asc else -1
     for game in games:
-        region_score = get_index(selected_regions, game.region, UNSELECTED)
-        languages_score = sum([
-            (get_index(selected_languages, lang, -1) + 1) * -language_weight
-            for lang in game.languages])
-        revision_int = to_int_list(
-            game.revision,
-            1 if revision_asc else -1)
-        version_int = to_int_list(game.version, 1 if version_asc else -1)
+        region_score = region_ranks.get(game.region, UNSELECTED)
+        languages_score = language_value(
+            game.languages,
+            language_weight,
+            language_ranks) if game.languages else 0
+        revision_int = to_int_list(game.revision, revision_multiplier)
+        version_int = to_int_list(game.version, version_multiplier)
         sample_int = to_int_list(game.sample, -1)
         demo_int = to_int_list(game.demo, -1)
         beta_int = to_int_list(game.beta, -1)
@@ -1040,224 +1401,323 @@ def transfer_file(
         move: bool) -> None:
     try:
         if move:
-            print('Moving [%s] to [%s]' % (input_path, output_path))
-            shutil.move(str(input_path), str(output_path))
+            print_line('Moving [%s] to [%s]' % (input_path, output_path))
+            move_file(str(input_path), str(output_path))
         else:
-            print('Copying [%s] to [%s]' % (input_path, output_path))
-            shutil.copy2(str(input_path), str(output_path))
+            print_line('Copying [%s] to [%s]' % (input_path, output_path))
+            copy_file(str(input_path), str(output_path))
     except OSError as e:
-        print(
+        print_line(
             'Error while transferring file: %s\033[K' % e,
-            file=sys.stderr)
+            sys.stderr)
+
+
+def transfer_files(
+        transfers: List[Tuple[Path, Path]],
+        move: bool,
+        executor: Optional[Executor] = None) -> None:
+    if move or not executor or len(transfers) < 2:
+        for input_path, output_path in transfers:
+            transfer_file(input_path, output_path, move)
+        return
+    for input_path, output_path in transfers:
+        print_line('Copying [%s] to [%s]' % (input_path, output_path))
+    futures = [
+        executor.submit(copy_file, str(input_path), str(output_path))
+        for input_path, output_path in transfers]
+    for future in futures:
+        try:
+            future.result()
+        except OSError as e:
+            print_line(
+                'Error while transferring file: %s\033[K' % e,
+                sys.stderr)
+
+
+def print_line(s: str, file: Optional[TextIO] = None) -> None:
+    # Written at once, so lines printed by concurrent transfers do not mix
+    (file if file else sys.stdout).write('%s\n' % s)
+
+
+def move_file(input_path: str, output_path: str) -> None:
+    if os.path.isdir(output_path):
+        output_path = os.path.join(output_path, os.path.basename(input_path))
+        # Same as shutil.move, files moved into a directory never overwrite
+        if os.path.exists(output_path):
+            raise shutil.Error(
+                "Destination path '%s' already exists" % output_path)
+    try:
+        os.rename(input_path, output_path)
+    except OSError:
+        # Across file systems, or over an existing file on Windows, the file
+        # is copied and removed instead, as shutil.move does
+        shutil.move(input_path, output_path)
+
+
+def copy_file(input_path: str, output_path: str) -> None:
+    if hasattr(os, 'copy_file_range'):
+        if os.path.isdir(output_path):
+            output_path = os.path.join(
+                output_path,
+                os.path.basename(input_path))
+        # Opening the output first would truncate the input itself
+        if os.path.exists(output_path) \
+                and os.path.samefile(input_path, output_path):
+            raise shutil.SameFileError(
+                '%r and %r are the same file' % (input_path, output_path))
+        try:
+            # Copies within the kernel, or even shares the data blocks on
+            # filesystems that support it, instead of reading and writing
+            with open(input_path, 'rb') as input_file, \
+                    open(output_path, 'wb') as output_file:
+                copied = 0
+                while True:
+                    size = os.copy_file_range(
+                        input_file.fileno(),
+                        output_file.fileno(),
+                        COPY_RANGE_SIZE)
+                    if not size:
+                        break
+                    copied += size
+                # Some filesystems silently copy nothing at all
+                complete = copied == os.fstat(input_file.fileno()).st_size
+            if complete:
+                shutil.copystat(input_path, output_path)
+                return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_COPY_ERRNOS:
+                raise
+    shutil.copy2(input_path, output_path)
 
 
 def log(s: str) -> None:
     print(s, file=LOG_FILE if LOG_FILE else sys.stderr)
 
 
-def help_msg(s: Optional[Union[str, Exception]] = None) -> str:
-    help_str = '\n'.join([
-        'Usage: python3 %s [options] -d input_file.dat' % sys.argv[0],
+def log_lines(lines: List[str]) -> None:
+    (LOG_FILE if LOG_FILE else sys.stderr).writelines(
+        '%s\n' % s for s in lines)
 
-        'Options:',
 
-        '\n# ROM selection and file manipulation:',
+HELP_TEXT = '\n'.join([
+    'Usage: python3 %s [options] -d input_file.dat',
 
-        '\t-r,--regions=REGIONS\t'
-        'A list of regions separated by commas'
-        '\n\t\t\t\t'
-        'Ex.: -r USA,EUR,JPN',
+    'Options:',
 
-        '\t-l,--languages=LANGS\t'
-        'An optional list of languages separated by commas'
-        '\n\t\t\t\t'
-        'This is a secondary prioritization criteria, not a filter'
-        '\n\t\t\t\t'
-        'Ex.: -l en,es,ru',
+    '\n# ROM selection and file manipulation:',
 
-        '\t-d,--dat=DAT_FILE\t'
-        'The DAT file to be used'
-        '\n\t\t\t\t'
-        'Ex.: -d snes.dat',
+    '\t-r,--regions=REGIONS\t'
+    'A list of regions separated by commas'
+    '\n\t\t\t\t'
+    'Ex.: -r USA,EUR,JPN',
 
-        '\t-i,--input-dir=PATH\t'
-        'Provides an input directory (i.e.: where your ROMs are)'
-        '\n\t\t\t\t'
-        'Ex.: -i "C:\\Users\\John\\Downloads\\Emulators\\SNES\\ROMs"',
+    '\t-l,--languages=LANGS\t'
+    'An optional list of languages separated by commas'
+    '\n\t\t\t\t'
+    'This is a secondary prioritization criteria, not a filter'
+    '\n\t\t\t\t'
+    'Ex.: -l en,es,ru',
 
-        '\t-o,--output-dir=PATH\t'
-        'If provided, ROMs will be copied to an output directory'
-        '\n\t\t\t\t'
-        'Ex.: -o "C:\\Users\\John\\Downloads\\Emulators\\SNES\\ROMs\\1G1R"',
+    '\t-d,--dat=DAT_FILE\t'
+    'The DAT file to be used'
+    '\n\t\t\t\t'
+    'Ex.: -d snes.dat',
 
-        '\t--move\t\t\t'
-        'If set, ROMs will be moved, instead of copied, '
-        'to the output directory',
+    '\t-i,--input-dir=PATH\t'
+    'Provides an input directory (i.e.: where your ROMs are)'
+    '\n\t\t\t\t'
+    'Ex.: -i "C:\\Users\\John\\Downloads\\Emulators\\SNES\\ROMs"',
 
-        '\t--group-by-first-letter\t'
-        'If set, groups ROMs on the output directory in subfolders according '
-        'to the first letter in their name',
+    '\t-o,--output-dir=PATH\t'
+    'If provided, ROMs will be copied to an output directory'
+    '\n\t\t\t\t'
+    'Ex.: -o "C:\\Users\\John\\Downloads\\Emulators\\SNES\\ROMs\\1G1R"',
 
-        '\n# File scanning:',
+    '\t--move\t\t\t'
+    'If set, ROMs will be moved, instead of copied, '
+    'to the output directory',
 
-        '\t--header-file=PATH\t'
-        'Sets the header file to be used when scanning headered ROMs'
-        '\n\t\t\t\t'
-        'You can also just add the file to the headers directory',
+    '\t--group-by-first-letter\t'
+    'If set, groups ROMs on the output directory in subfolders according '
+    'to the first letter in their name',
 
-        '\t--threads=THREADS\t'
-        'Sets the number of I/O threads to be used to read files'
-        '\n\t\t\t\t'
-        'Default: 4',
+    '\n# File scanning:',
 
-        '\t--chunk-size=BYTES\t'
-        'Sets the chunk size for buffered I/O operations (bytes)'
-        '\n\t\t\t\t'
-        'Default: 33554432 (32 MiB)',
+    '\t--header-file=PATH\t'
+    'Sets the header file to be used when scanning headered ROMs'
+    '\n\t\t\t\t'
+    'You can also just add the file to the headers directory',
 
-        '\t--max-file-size=BYTES\t'
-        'Sets the maximum file size for header information processing (bytes)'
-        '\n\t\t\t\t'
-        'Default: 268435456 (256 MiB)',
+    '\t--threads=THREADS\t'
+    'Sets the number of I/O threads to be used to read files'
+    '\n\t\t\t\t'
+    'Default: 4',
 
-        '\t--no-scan\t\t'
-        'If set, ROMs are not scanned and only file names are used to identify '
-        'candidates',
+    '\t--chunk-size=BYTES\t'
+    'Sets the chunk size for buffered I/O operations (bytes)'
+    '\n\t\t\t\t'
+    'Default: 33554432 (32 MiB)',
 
-        '\t-e,--extension=EXT\t'
-        'When not scanning, ROM file names will use this extension'
-        '\n\t\t\t\t'
-        'Ex.: -e zip',
+    '\t--max-file-size=BYTES\t'
+    'Sets the maximum file size for header information processing (bytes)'
+    '\n\t\t\t\t'
+    'Default: 268435456 (256 MiB)',
 
-        '\n# Filtering:',
+    '\t--trust-zip-crc\t\t'
+    'If set, ZIP entries matching the CRC32 and size of a ROM in the DAT '
+    'are not decompressed and hashed',
 
-        '\t--no-bios\t\t'
-        'Filter out BIOSes',
+    '\t--hash-cache=PATH\t'
+    'Stores file hashes in this file, so unchanged files are not hashed '
+    'again on later runs'
+    '\n\t\t\t\t'
+    'Ex.: --hash-cache hashes.db',
 
-        '\t--no-program\t\t'
-        'Filter out Programs and Test Programs',
+    '\t--no-scan\t\t'
+    'If set, ROMs are not scanned and only file names are used to identify '
+    'candidates',
 
-        '\t--no-enhancement-chip\t'
-        'Filter out Ehancement Chips',
+    '\t-e,--extension=EXT\t'
+    'When not scanning, ROM file names will use this extension'
+    '\n\t\t\t\t'
+    'Ex.: -e zip',
 
-        '\t--no-proto\t\t'
-        'Filter out prototype ROMs',
+    '\n# Filtering:',
 
-        '\t--no-beta\t\t'
-        'Filter out beta ROMs',
+    '\t--no-bios\t\t'
+    'Filter out BIOSes',
 
-        '\t--no-demo\t\t'
-        'Filter out demo ROMs',
+    '\t--no-program\t\t'
+    'Filter out Programs and Test Programs',
 
-        '\t--no-sample\t\t'
-        'Filter out sample ROMs',
+    '\t--no-enhancement-chip\t'
+    'Filter out Ehancement Chips',
 
-        '\t--no-pirate\t\t'
-        'Filter out pirate ROMs',
+    '\t--no-proto\t\t'
+    'Filter out prototype ROMs',
 
-        '\t--no-promo\t\t'
-        'Filter out promotion ROMs',
+    '\t--no-beta\t\t'
+    'Filter out beta ROMs',
 
-        '\t--no-all\t\t'
-        'Apply all filters above (WILL STILL ALLOW UNLICENSED ROMs)',
+    '\t--no-demo\t\t'
+    'Filter out demo ROMs',
 
-        '\t--no-unlicensed\t\t'
-        'Filter out unlicensed ROMs',
+    '\t--no-sample\t\t'
+    'Filter out sample ROMs',
 
-        '\t--all-regions\t\t'
-        'Includes files of unselected regions, if a selected one is not '
-        'available',
+    '\t--no-pirate\t\t'
+    'Filter out pirate ROMs',
 
-        '\t--all-regions-with-lang\t'
-        'Same as --all-regions, but only if a ROM has at least one selected '
-        'language',
+    '\t--no-promo\t\t'
+    'Filter out promotion ROMs',
 
-        '\t--only-selected-lang\t'
-        'Filter out ROMs without any selected languages',
+    '\t--no-all\t\t'
+    'Apply all filters above (WILL STILL ALLOW UNLICENSED ROMs)',
 
-        '\n# Adjustment and customization:',
+    '\t--no-unlicensed\t\t'
+    'Filter out unlicensed ROMs',
 
-        '\t-w,--language-weight=N\t'
-        'The degree of priority the first selected languages receive over the '
-        'latter ones'
-        '\n\t\t\t\t'
-        'Default: 3',
+    '\t--all-regions\t\t'
+    'Includes files of unselected regions, if a selected one is not '
+    'available',
 
-        '\t--prioritize-languages\t'
-        'If set, ROMs matching more languages will be prioritized over ROMs '
-        'matching regions',
+    '\t--all-regions-with-lang\t'
+    'Same as --all-regions, but only if a ROM has at least one selected '
+    'language',
 
-        '\t--early-revisions\t'
-        'ROMs of earlier revisions will be prioritized',
+    '\t--only-selected-lang\t'
+    'Filter out ROMs without any selected languages',
 
-        '\t--early-versions\t'
-        'ROMs of earlier versions will be prioritized',
+    '\n# Adjustment and customization:',
 
-        '\t--input-order\t\t'
-        'ROMs will be prioritized by the order they '
-        'appear in the DAT file',
+    '\t-w,--language-weight=N\t'
+    'The degree of priority the first selected languages receive over the '
+    'latter ones'
+    '\n\t\t\t\t'
+    'Default: 3',
 
-        '\t--prefer-parents\t'
-        'Parent ROMs will be prioritized over clones',
+    '\t--prioritize-languages\t'
+    'If set, ROMs matching more languages will be prioritized over ROMs '
+    'matching regions',
 
-        '\t--prefer-prereleases\t'
-        'Prerelease (Beta, Proto, etc.) ROMs will be prioritized',
+    '\t--early-revisions\t'
+    'ROMs of earlier revisions will be prioritized',
 
-        '\t--prefer=WORDS\t\t'
-        'ROMs containing these words will be preferred'
-        '\n\t\t\t\t'
-        'Ex.: --prefer "Virtual Console,GameCube"'
-        '\n\t\t\t\t'
-        'Ex.: --prefer "file:prefer.txt" ',
+    '\t--early-versions\t'
+    'ROMs of earlier versions will be prioritized',
 
-        '\t--avoid=WORDS\t\t'
-        'ROMs containing these words will be avoided (but not excluded).'
-        '\n\t\t\t\t'
-        'Ex.: --avoid "Virtual Console,GameCube"'
-        '\n\t\t\t\t'
-        'Ex.: --avoid "file:avoid.txt" ',
+    '\t--input-order\t\t'
+    'ROMs will be prioritized by the order they '
+    'appear in the DAT file',
 
-        '\t--exclude=WORDS\t\t'
-        'ROMs containing these words will be excluded.'
-        '\n\t\t\t\t'
-        'Ex.: --exclude "Virtual Console,GameCube"'
-        '\n\t\t\t\t'
-        'Ex.: --exclude "file:exclude.txt"',
+    '\t--prefer-parents\t'
+    'Parent ROMs will be prioritized over clones',
 
-        '\t--exclude-after=WORDS\t'
-        'If the best candidate contains these words, skip all candidates.'
-        '\n\t\t\t\t'
-        'Ex.: --exclude-after "Virtual Console,GameCube"'
-        '\n\t\t\t\t'
-        'Ex.: --exclude-after "file:exclude-after.txt"',
+    '\t--prefer-prereleases\t'
+    'Prerelease (Beta, Proto, etc.) ROMs will be prioritized',
 
-        '\t--ignore-case\t\t'
-        'If set, the avoid and exclude lists will be case-insensitive',
+    '\t--prefer=WORDS\t\t'
+    'ROMs containing these words will be preferred'
+    '\n\t\t\t\t'
+    'Ex.: --prefer "Virtual Console,GameCube"'
+    '\n\t\t\t\t'
+    'Ex.: --prefer "file:prefer.txt" ',
 
-        '\t--regex\t\t\t'
-        'If set, the avoid and exclude lists are used as regular expressions',
+    '\t--avoid=WORDS\t\t'
+    'ROMs containing these words will be avoided (but not excluded).'
+    '\n\t\t\t\t'
+    'Ex.: --avoid "Virtual Console,GameCube"'
+    '\n\t\t\t\t'
+    'Ex.: --avoid "file:avoid.txt" ',
 
-        '\t--separator=SEP\t\t'
-        'Provides a separator for the avoid, exclude & exclude-after options.'
-        '\n\t\t\t\t'
-        'Default: ","',
+    '\t--exclude=WORDS\t\t'
+    'ROMs containing these words will be excluded.'
+    '\n\t\t\t\t'
+    'Ex.: --exclude "Virtual Console,GameCube"'
+    '\n\t\t\t\t'
+    'Ex.: --exclude "file:exclude.txt"',
 
-        '\n# Help and debugging:',
+    '\t--exclude-after=WORDS\t'
+    'If the best candidate contains these words, skip all candidates.'
+    '\n\t\t\t\t'
+    'Ex.: --exclude-after "Virtual Console,GameCube"'
+    '\n\t\t\t\t'
+    'Ex.: --exclude-after "file:exclude-after.txt"',
 
-        '\t-h,--help\t\t'
-        'Prints this usage message',
+    '\t--ignore-case\t\t'
+    'If set, the avoid and exclude lists will be case-insensitive',
 
-        '\t-v,--version\t\t'
-        'Prints the version',
+    '\t--regex\t\t\t'
+    'If set, the avoid and exclude lists are used as regular expressions',
 
-        '\t-V,--verbose\t\t'
-        'Logs more messages (useful when troubleshooting)',
+    '\t--separator=SEP\t\t'
+    'Provides a separator for the avoid, exclude & exclude-after options.'
+    '\n\t\t\t\t'
+    'Default: ","',
 
-        '\t--debug\t\t\t'
-        'Logs even more messages (useful when troubleshooting)',
+    '\n# Help and debugging:',
 
-        '\n# See https://github.com/andrebrait/1g1r-romset-generator/wiki '
-        'for more details'])
+    '\t-h,--help\t\t'
+    'Prints this usage message',
+
+    '\t-v,--version\t\t'
+    'Prints the version',
+
+    '\t-V,--verbose\t\t'
+    'Logs more messages (useful when troubleshooting)',
+
+    '\t--debug\t\t\t'
+    'Logs even more messages (useful when troubleshooting)',
+
+    '\t--no-warning\t\t'
+    'Does not log warnings about candidates and ROMs that were not found',
+
+    '\n# See https://github.com/andrebrait/1g1r-romset-generator/wiki '
+    'for more details'])
+
+
+def help_msg(s: Optional[Union[str, Exception]] = None) -> str:
+    help_str = HELP_TEXT % sys.argv[0]
     if s:
         return '%s\n%s' % (s, help_str)
     else:
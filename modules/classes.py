@@ -1,8 +1,9 @@
+import sqlite3
 import sys
 from json.encoder import JSONEncoder
 from pathlib import Path, PurePath
 from threading import Lock, Thread
-from typing import Optional, List, Pattern, TextIO, Tuple, Any
+from typing import Optional, List, Pattern, TextIO, Tuple, Any, NamedTuple
 
 from modules.datafile import rom
 from modules.utils import check_in_pattern_list, trim_to, available_columns
@@ -34,25 +35,64 @@ class FileData:
         return file_data.size
 
 
-class Score:
-    def __init__(
+class HashCache:
+    # Inserts are committed in batches, so an interrupted scan keeps them
+    COMMIT_INTERVAL = 256
+
+    def __init__(self, path: Path):
+        self.__pending = 0
+        self.__connection = sqlite3.connect(str(path))
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute(
+            'CREATE TABLE IF NOT EXISTS hashes ('
+            'path TEXT NOT NULL, '
+            'options TEXT NOT NULL, '
+            'size INTEGER NOT NULL, '
+            'mtime INTEGER NOT NULL, '
+            'digests TEXT NOT NULL, '
+            'PRIMARY KEY (path, options))')
+
+    def get(
             self,
-            region: int,
-            languages: int,
-            revision: List[int],
-            version: List[int],
-            sample: List[int],
-            demo: List[int],
-            beta: List[int],
-            proto: List[int]):
-        self.region = region
-        self.languages = languages
-        self.revision = revision
-        self.version = version
-        self.sample = sample
-        self.demo = demo
-        self.beta = beta
-        self.proto = proto
+            path: str,
+            options: str,
+            size: int,
+            mtime: int) -> Optional[List[str]]:
+        row = self.__connection.execute(
+            'SELECT digests FROM hashes '
+            'WHERE path = ? AND options = ? AND size = ? AND mtime = ?',
+            (path, options, size, mtime)).fetchone()
+        return row[0].split(',') if row else None
+
+    def put(
+            self,
+            path: str,
+            options: str,
+            size: int,
+            mtime: int,
+            digests: List[str]) -> None:
+        self.__connection.execute(
+            'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)',
+            (path, options, size, mtime, ','.join(digests)))
+        self.__pending += 1
+        if self.__pending >= HashCache.COMMIT_INTERVAL:
+            self.__connection.commit()
+            self.__pending = 0
+
+    def close(self) -> None:
+        self.__connection.commit()
+        self.__connection.close()
+
+
+class Score(NamedTuple):
+    region: int
+    languages: int
+    revision: Tuple[int, ...]
+    version: Tuple[int, ...]
+    sample: Tuple[int, ...]
+    demo: Tuple[int, ...]
+    beta: Tuple[int, ...]
+    proto: Tuple[int, ...]
 
 
 class GameEntry:
@@ -144,8 +184,8 @@ class GameEntryKeyGenerator:
             prefer_prereleases: bool,
             prefer_parents: bool,
             input_order: bool,
-            prefer: List[Pattern],
-            avoid: List[Pattern]):
+            prefer: Tuple[Pattern, ...],
+            avoid: Tuple[Pattern, ...]):
         self.prioritize_languages = prioritize_languages
         self.prefer_prereleases = prefer_prereleases
         self.prefer_parents = prefer_parents
@@ -264,9 +304,10 @@ class CustomJsonEncoder(JSONEncoder):
                 for ji, jj in o.__dict__.items() if not ji.endswith('_')
             }
         if isinstance(o, GameEntry):
-            return o.__dict__
-        if isinstance(o, Score):
-            return o.__dict__
+            if o.score is None:
+                return o.__dict__
+            # Named tuples would otherwise be encoded as plain lists
+            return dict(o.__dict__, score=o.score._asdict())
         if isinstance(o, PurePath):
             return str(o)
         return super().default(o)
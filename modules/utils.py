@@ -1,16 +1,18 @@
+import os
+import re
 import shutil
-from typing import List, Any, Pattern, Optional, Match, Iterable
+from functools import lru_cache
+from typing import List, Any, Pattern, Optional, Match, Iterable, Dict, \
+    Tuple
 
 TRIM_PREFIX = '(...)'
 
 
-def get_index(ls: List[Any], item: Any, default: int) -> int:
-    try:
-        if ls:
-            return ls.index(item)
-        return default
-    except ValueError:
-        return default
+def to_index_dict(ls: List[Any], start: int = 0) -> Dict[Any, int]:
+    index_dict = {}
+    for i, item in enumerate(ls, start):
+        index_dict.setdefault(item, i)
+    return index_dict
 
 
 def check_in_pattern_list(name: str, patterns: Iterable[Pattern]) -> bool:
@@ -21,8 +23,29 @@ def check_in_pattern_list(name: str, patterns: Iterable[Pattern]) -> bool:
     return False
 
 
-def to_int_list(string: str, multiplier: int) -> List[int]:
-    return [multiplier * ord(x) for x in string]
+def combine_patterns(patterns: Tuple[Pattern, ...]) -> Tuple[Pattern, ...]:
+    if len(patterns) < 2:
+        return patterns
+    flags = patterns[0].flags
+    # Numbered groups would be shifted in the combined pattern, breaking
+    # any backreferences to them, and inline flags would apply to all
+    if flags & re.VERBOSE or any(
+            pattern.groups or pattern.flags != flags
+            for pattern in patterns[1:]):
+        return patterns
+    try:
+        return (re.compile(
+            '|'.join('(?:%s)' % pattern.pattern for pattern in patterns),
+            flags),)
+    except re.error:
+        return patterns
+
+
+@lru_cache(maxsize=4096)
+def to_int_list(string: str, multiplier: int) -> Tuple[int, ...]:
+    if not string:
+        return ()
+    return tuple(multiplier * ord(x) for x in string)
 
 
 def get(ls: List[int], index: int) -> int:
@@ -58,5 +81,14 @@ def trim_to(obj: Any, n: int) -> str:
     return text
 
 
+def relative_path(path: str, directory: str) -> str:
+    prefix = directory if directory.endswith(os.sep) else directory + os.sep
+    return path[len(prefix):] if path.startswith(prefix) else path
+
+
 def is_valid(x: str) -> bool:
     return bool(x and not x.isspace())
+
+
+def has_zip_extension(file_name: str) -> bool:
+    return file_name[-4:].lower() == '.zip'